@@ -1,17 +1,201 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
-from functools import wraps
+from flask import (Flask, render_template, request, redirect, url_for, session, flash, jsonify, g,
+                   make_response)
+from functools import wraps, lru_cache
 from datetime import datetime, timedelta
+import hashlib
+import json
+import os
 import secrets
+import threading
+import time
+import redis
+from flask_session import Session
+from sqlalchemy import event, select, func, case
+from sqlalchemy.orm import joinedload, raiseload
+from werkzeug.security import generate_password_hash, check_password_hash
 from models import (init_db, User, Complaint, Response, UserRole, 
-                    ComplaintStatus, ComplaintPriority, create_admin_user)
+                    ComplaintStatus, ComplaintPriority, create_admin_user,
+                    create_schema, PASSWORD_HASH_METHOD)
+from tasks import send_complaint_notification
 
 app = Flask(__name__)
-app.secret_key = secrets.token_hex(16)
+# Every worker must sign sessions with the same key; wsgi.py refuses to start without it
+app.secret_key = os.environ.get('SECRET_KEY')
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=24)
 
-# Initialize database
+# Redis (e.g. REDIS_URL=unix:///var/run/redis/redis.sock) backs server-side sessions;
+# without it sessions stay in signed cookies
+redis_client = redis.Redis.from_url(os.environ['REDIS_URL']) if os.environ.get('REDIS_URL') else None
+if redis_client is not None:
+    app.config.update(SESSION_TYPE='redis', SESSION_REDIS=redis_client)
+    Session(app)
+
+# Checked against when the username is unknown so failed logins take equally long
+DUMMY_PASSWORD_HASH = generate_password_hash(secrets.token_hex(16), method=PASSWORD_HASH_METHOD)
+
+# Initialize database; the schema itself is created by `flask --app app init-db`
 db_session, engine = init_db()
-create_admin_user(db_session)
+
+def setup_database():
+    create_schema(engine)
+    create_admin_user(db_session)
+    db_session.remove()
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create tables, indexes and the default admin user"""
+    setup_database()
+
+@app.teardown_appcontext
+def shutdown_session(exception=None):
+    db_session.remove()
+
+# SQL statements allowed per request before a debug/testing warning; guards against N+1
+DEFAULT_QUERY_BUDGET = 5
+ROUTE_BUDGETS = {
+    'admin_dashboard': 5,
+    'view_complaint': 4,
+    'user_dashboard': 3,
+    'manage_users': 3,
+    'reports': 3,
+}
+query_counts = threading.local()
+
+# debug/testing are only known once the app runs, so each hook checks them itself
+@event.listens_for(engine, 'before_cursor_execute')
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    if app.debug or app.testing:
+        query_counts.n = getattr(query_counts, 'n', 0) + 1
+
+@app.before_request
+def reset_query_count():
+    if app.debug or app.testing:
+        query_counts.n = 0
+
+@app.after_request
+def check_query_budget(response):
+    if app.debug or app.testing:
+        budget = ROUTE_BUDGETS.get(request.endpoint, DEFAULT_QUERY_BUDGET)
+        count = getattr(query_counts, 'n', 0)
+        if count > budget:
+            app.logger.warning('%s ran %d SQL statements (budget %d)',
+                               request.endpoint, count, budget)
+    return response
+
+def eager(*options):
+    """Loader options for list queries; in debug/testing any other lazy load raises"""
+    if app.debug or app.testing:
+        options += (raiseload('*'),)
+    return options
+
+def count_by_status():
+    """Map each ComplaintStatus to its complaint count in a single GROUP BY"""
+    rows = db_session.execute(
+        select(Complaint.status, func.count(Complaint.id)).group_by(Complaint.status)
+    ).all()
+    return {ComplaintStatus[name]: count for name, count in rows}
+
+# Redis keys of cached aggregates, dropped whenever complaints or users change
+ADMIN_STATS_KEY = 'admin:stats:v1'
+REPORT_STATS_KEY = 'reports:stats:v1'
+
+def cached(key, ttl=30):
+    """Cache a function's JSON-serializable result in Redis for ttl seconds"""
+    def decorator(f):
+        @wraps(f)
+        def wrapper():
+            if redis_client is None:
+                return f()
+            value = redis_client.get(key)
+            if value is not None:
+                return json.loads(value)
+            value = f()
+            redis_client.setex(key, ttl, json.dumps(value))
+            return value
+        return wrapper
+    return decorator
+
+def invalidate_stats():
+    if redis_client is not None:
+        redis_client.delete(ADMIN_STATS_KEY, REPORT_STATS_KEY)
+
+@cached(ADMIN_STATS_KEY)
+def get_admin_stats():
+    status_rows = count_by_status()
+    return {
+        'total': sum(status_rows.values()),
+        'pending': status_rows.get(ComplaintStatus.PENDING, 0),
+        'escalated': status_rows.get(ComplaintStatus.ESCALATED, 0),
+        'users': db_session.scalar(
+            select(func.count(User.id)).where(User.role == UserRole.CITIZEN)
+        )
+    }
+
+@cached(REPORT_STATS_KEY)
+def get_report_stats():
+    status_rows = count_by_status()
+    category_counts = db_session.execute(
+        select(Complaint.category, func.count(Complaint.id)).group_by(Complaint.category)
+    ).all()
+    return {
+        'total': sum(status_rows.values()),
+        'status_counts': {status.value: status_rows.get(status, 0) for status in ComplaintStatus},
+        'category_counts': [list(row) for row in category_counts]
+    }
+
+def current_user():
+    """The logged-in User, loaded at most once per request"""
+    if 'current_user' not in g:
+        g.current_user = db_session.get(User, session['user_id'])
+    return g.current_user
+
+def session_role_is_current():
+    """Whether the user still holds the role stored in their session (cached 60s in Redis)"""
+    if redis_client is None:
+        user = current_user()
+        return bool(user and user.is_active and user.role.value == session['role'])
+    key = f"user:{session['user_id']}:role"
+    role = redis_client.get(key)
+    if role is not None:
+        return role.decode() == session['role']
+    user = current_user()
+    role = user.role.value if user and user.is_active else ''
+    redis_client.setex(key, 60, role)
+    return role == session['role']
+
+@lru_cache(maxsize=1)
+def _ticket_date(day):
+    return (datetime(1970, 1, 1) + timedelta(days=day)).strftime('%Y%m%d')
+
+def generate_ticket_number():
+    """COMP-<UTC date>-<6 random hex digits>; the date string is formatted once per day"""
+    return f"COMP-{_ticket_date(int(time.time()) // 86400)}-{os.urandom(3).hex().upper()}"
+
+def notify_complainant(complaint, message):
+    """Queue a notification; a broker failure is logged and never fails the request"""
+    try:
+        send_complaint_notification.delay(complaint.user.email, complaint.ticket_number, message)
+    except Exception:
+        app.logger.exception('Could not queue notification for %s', complaint.ticket_number)
+
+# Conditional GET helpers: validate a page by a few cheap values before rendering it
+def page_etag(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+def not_modified(etag):
+    """A 304 response if the client already holds this version of the page"""
+    # Pending flash messages must still be rendered into a fresh page
+    if '_flashes' in session or not request.if_none_match.contains_weak(etag):
+        return None
+    return with_etag(app.response_class(status=304), etag)
+
+def with_etag(body, etag):
+    response = make_response(body)
+    response.set_etag(etag, weak=True)
+    # Revalidate on every view so redirects after a POST never show a stale page
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 # Authentication decorator
 def login_required(f):
@@ -28,8 +212,8 @@ def admin_required(f):
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             return redirect(url_for('login'))
-        user = db_session.query(User).get(session['user_id'])
-        if not user or user.role not in [UserRole.ADMIN, UserRole.STAFF]:
+        if (session.get('role') not in [UserRole.ADMIN.value, UserRole.STAFF.value]
+                or not session_role_is_current()):
             flash('Access denied. Admin privileges required.', 'error')
             return redirect(url_for('index'))
         return f(*args, **kwargs)
@@ -45,10 +229,10 @@ def register():
     if request.method == 'POST':
         try:
             # Check if user exists
-            existing_user = db_session.query(User).filter(
+            existing_user = db_session.scalars(select(User).where(
                 (User.email == request.form['email']) | 
                 (User.username == request.form['username'])
-            ).first()
+            )).first()
             
             if existing_user:
                 flash('Email or username already exists!', 'error')
@@ -67,6 +251,7 @@ def register():
             
             db_session.add(user)
             db_session.commit()
+            invalidate_stats()
             
             flash('Registration successful! Please log in.', 'success')
             return redirect(url_for('login'))
@@ -84,7 +269,9 @@ def login():
         username = request.form['username']
         password = request.form['password']
         
-        user = db_session.query(User).filter_by(username=username).first()
+        user = db_session.scalars(select(User).where(User.username == username)).first()
+        if user is None:
+            check_password_hash(DUMMY_PASSWORD_HASH, password)
         
         if user and user.check_password(password) and user.is_active:
             session['user_id'] = user.id
@@ -111,53 +298,63 @@ def logout():
 @app.route('/dashboard')
 @login_required
 def user_dashboard():
-    user = db_session.query(User).get(session['user_id'])
-    complaints = db_session.query(Complaint).filter_by(user_id=user.id).order_by(
-        Complaint.created_at.desc()
-    ).all()
+    user = current_user()
     
-    stats = {
-        'total': len(complaints),
-        'pending': len([c for c in complaints if c.status == ComplaintStatus.PENDING]),
-        'in_progress': len([c for c in complaints if c.status == ComplaintStatus.IN_PROGRESS]),
-        'resolved': len([c for c in complaints if c.status == ComplaintStatus.RESOLVED])
-    }
+    def count_status(status):
+        return func.coalesce(func.sum(case((Complaint.status == status, 1), else_=0)), 0)
+    
+    row = db_session.execute(select(
+        func.count(Complaint.id).label('total'),
+        count_status(ComplaintStatus.PENDING).label('pending'),
+        count_status(ComplaintStatus.IN_PROGRESS).label('in_progress'),
+        count_status(ComplaintStatus.RESOLVED).label('resolved'),
+        func.max(Complaint.updated_at).label('last_updated')
+    ).where(Complaint.user_id == user.id)).one()
+    
+    stats = row._asdict()
+    etag = page_etag(user.id, stats.pop('last_updated'), stats)
+    cached_response = not_modified(etag)
+    if cached_response:
+        return cached_response
+    
+    complaints = db_session.scalars(
+        select(Complaint).where(Complaint.user_id == user.id).order_by(Complaint.created_at.desc())
+    ).all()
     
-    return render_template('user_dashboard.html', user=user, complaints=complaints, stats=stats)
+    return with_etag(render_template('user_dashboard.html', user=user, complaints=complaints,
+                                     stats=stats), etag)
 
 @app.route('/admin')
 @admin_required
 def admin_dashboard():
-    user = db_session.query(User).get(session['user_id'])
-    
-    # Statistics
-    total_complaints = db_session.query(Complaint).count()
-    pending_complaints = db_session.query(Complaint).filter_by(status=ComplaintStatus.PENDING).count()
-    escalated_complaints = db_session.query(Complaint).filter_by(status=ComplaintStatus.ESCALATED).count()
-    total_users = db_session.query(User).filter_by(role=UserRole.CITIZEN).count()
+    user = current_user()
+    stats = get_admin_stats()
     
-    # Recent complaints
-    recent_complaints = db_session.query(Complaint).order_by(
-        Complaint.created_at.desc()
-    ).limit(10).all()
+    etag = page_etag(user.id, stats, db_session.scalar(select(func.max(Complaint.updated_at))))
+    cached_response = not_modified(etag)
+    if cached_response:
+        return cached_response
     
-    stats = {
-        'total': total_complaints,
-        'pending': pending_complaints,
-        'escalated': escalated_complaints,
-        'users': total_users
-    }
+    # Recent complaints, as plain rows with status/priority mapped back to enum members
+    rows = db_session.execute(
+        select(Complaint.id, Complaint.ticket_number, Complaint.title, Complaint.category,
+               Complaint.status.label('status'), Complaint.priority.label('priority'),
+               Complaint.created_at, User.full_name.label('user_name'))
+        .join(Complaint.user)
+        .order_by(Complaint.created_at.desc()).limit(10)
+    ).all()
+    recent_complaints = [dict(row._mapping, status=ComplaintStatus[row.status],
+                              priority=ComplaintPriority[row.priority]) for row in rows]
     
-    return render_template('admin_dashboard.html', user=user, stats=stats, 
-                         complaints=recent_complaints)
+    return with_etag(render_template('admin_dashboard.html', user=user, stats=stats, 
+                                     complaints=recent_complaints), etag)
 
 @app.route('/complaint/new', methods=['GET', 'POST'])
 @login_required
 def new_complaint():
     if request.method == 'POST':
         try:
-            # Generate unique ticket number
-            ticket_number = f"COMP-{datetime.utcnow().strftime('%Y%m%d')}-{secrets.token_hex(3).upper()}"
+            ticket_number = generate_ticket_number()
             
             complaint = Complaint(
                 ticket_number=ticket_number,
@@ -171,13 +368,16 @@ def new_complaint():
             
             db_session.add(complaint)
             db_session.commit()
-            
-            flash(f'Complaint submitted successfully! Ticket: {ticket_number}', 'success')
-            return redirect(url_for('user_dashboard'))
+            invalidate_stats()
             
         except Exception as e:
             db_session.rollback()
             flash(f'Failed to submit complaint: {str(e)}', 'error')
+        
+        else:
+            notify_complainant(complaint, 'Your complaint has been received.')
+            flash(f'Complaint submitted successfully! Ticket: {ticket_number}', 'success')
+            return redirect(url_for('user_dashboard'))
     
     categories = ['Roads & Infrastructure', 'Water Supply', 'Sanitation', 'Electricity', 
                  'Public Safety', 'Healthcare', 'Education', 'Others']
@@ -187,30 +387,44 @@ def new_complaint():
 @app.route('/complaint/<int:complaint_id>')
 @login_required
 def view_complaint(complaint_id):
-    complaint = db_session.query(Complaint).get(complaint_id)
+    # Owner and assignee come back in the same SELECT as the complaint
+    complaint = db_session.get(Complaint, complaint_id, options=eager(
+        joinedload(Complaint.user), joinedload(Complaint.assigned_to_user)
+    ))
     
     if not complaint:
         flash('Complaint not found!', 'error')
         return redirect(url_for('user_dashboard'))
     
-    user = db_session.query(User).get(session['user_id'])
+    user = current_user()
     
     # Check access rights
     if user.role == UserRole.CITIZEN and complaint.user_id != user.id:
         flash('Access denied!', 'error')
         return redirect(url_for('user_dashboard'))
     
-    responses = db_session.query(Response).filter_by(complaint_id=complaint_id)
+    last_response_id = db_session.scalar(
+        select(func.max(Response.id)).where(Response.complaint_id == complaint_id)
+    )
+    etag = page_etag(user.id, complaint.id, complaint.updated_at, last_response_id)
+    cached_response = not_modified(etag)
+    if cached_response:
+        return cached_response
+    
+    query = select(Response).options(*eager(joinedload(Response.responder))).where(
+        Response.complaint_id == complaint_id
+    )
     if user.role == UserRole.CITIZEN:
-        responses = responses.filter_by(is_internal=0)
-    responses = responses.order_by(Response.created_at.asc()).all()
+        query = query.where(Response.is_internal == 0)
+    responses = db_session.scalars(query.order_by(Response.created_at.asc())).all()
     
-    return render_template('view_complaint.html', complaint=complaint, responses=responses)
+    return with_etag(render_template('view_complaint.html', complaint=complaint,
+                                     responses=responses), etag)
 
 @app.route('/complaint/<int:complaint_id>/update', methods=['POST'])
 @admin_required
 def update_complaint(complaint_id):
-    complaint = db_session.query(Complaint).get(complaint_id)
+    complaint = db_session.get(Complaint, complaint_id)
     
     if not complaint:
         return jsonify({'error': 'Complaint not found'}), 404
@@ -231,6 +445,7 @@ def update_complaint(complaint_id):
         
         complaint.updated_at = datetime.utcnow()
         db_session.commit()
+        invalidate_stats()
         
         flash('Complaint updated successfully!', 'success')
         
@@ -243,8 +458,8 @@ def update_complaint(complaint_id):
 @app.route('/complaint/<int:complaint_id>/respond', methods=['POST'])
 @login_required
 def respond_to_complaint(complaint_id):
-    complaint = db_session.query(Complaint).get(complaint_id)
-    user = db_session.query(User).get(session['user_id'])
+    complaint = db_session.get(Complaint, complaint_id)
+    user = current_user()
     
     if not complaint:
         flash('Complaint not found!', 'error')
@@ -265,18 +480,21 @@ def respond_to_complaint(complaint_id):
         db_session.add(response)
         db_session.commit()
         
-        flash('Response added successfully!', 'success')
-        
     except Exception as e:
         db_session.rollback()
         flash(f'Failed to add response: {str(e)}', 'error')
     
+    else:
+        if not is_internal and complaint.user_id != user.id:
+            notify_complainant(complaint, 'A new response has been posted.')
+        flash('Response added successfully!', 'success')
+    
     return redirect(url_for('view_complaint', complaint_id=complaint_id))
 
 @app.route('/complaint/<int:complaint_id>/escalate', methods=['POST'])
 @admin_required
 def escalate_complaint(complaint_id):
-    complaint = db_session.query(Complaint).get(complaint_id)
+    complaint = db_session.get(Complaint, complaint_id)
     
     if complaint:
         complaint.status = ComplaintStatus.ESCALATED
@@ -285,6 +503,8 @@ def escalate_complaint(complaint_id):
         complaint.updated_at = datetime.utcnow()
         
         db_session.commit()
+        invalidate_stats()
+        notify_complainant(complaint, 'Your complaint has been escalated.')
         flash('Complaint escalated successfully!', 'success')
     
     return redirect(url_for('view_complaint', complaint_id=complaint_id))
@@ -292,28 +512,35 @@ def escalate_complaint(complaint_id):
 @app.route('/admin/users')
 @admin_required
 def manage_users():
-    users = db_session.query(User).order_by(User.created_at.desc()).all()
-    return render_template('manage_users.html', users=users)
+    user_count, last_created = db_session.execute(
+        select(func.count(User.id), func.max(User.created_at))
+    ).one()
+    etag = page_etag(session['user_id'], user_count, last_created)
+    cached_response = not_modified(etag)
+    if cached_response:
+        return cached_response
+    
+    # Plain rows with role mapped back to a UserRole member
+    rows = db_session.execute(
+        select(User.id, User.full_name, User.username, User.email, User.role.label('role'),
+               User.phone, User.is_active, User.created_at)
+        .order_by(User.created_at.desc())
+    ).all()
+    users = [dict(row._mapping, role=UserRole[row.role]) for row in rows]
+    return with_etag(render_template('manage_users.html', users=users), etag)
 
 @app.route('/admin/reports')
 @admin_required
 def reports():
-    # Generate various statistics
-    total_complaints = db_session.query(Complaint).count()
-    
-    status_counts = {}
-    for status in ComplaintStatus:
-        count = db_session.query(Complaint).filter_by(status=status).count()
-        status_counts[status.value] = count
-    
-    category_counts = db_session.query(
-        Complaint.category, 
-    ).group_by(Complaint.category).all()
+    stats = get_report_stats()
     
     return render_template('reports.html', 
-                         total=total_complaints,
-                         status_counts=status_counts,
-                         category_counts=category_counts)
+                         total=stats['total'],
+                         status_counts=stats['status_counts'],
+                         category_counts=stats['category_counts'])
 
 if __name__ == '__main__':
+    # Single-process dev server: a throwaway key is fine when none is configured
+    app.secret_key = app.secret_key or secrets.token_hex(16)
+    setup_database()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
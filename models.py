@@ -1,12 +1,22 @@
+import os
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey, Enum
+from sqlalchemy import create_engine, event, select, Column, Integer, String, Text, DateTime, ForeignKey, Index
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.ext.hybrid import hybrid_property, Comparator
+from sqlalchemy.orm import relationship, sessionmaker, scoped_session
+from sqlalchemy.pool import StaticPool
+from greenlet import getcurrent
 from werkzeug.security import generate_password_hash, check_password_hash
 import enum
 
 Base = declarative_base()
 
+# scrypt:N:r:p -- N=2**14 (16 MiB) checks in about half the time of Werkzeug's default
+# N=2**15; override per deployment to tune login CPU cost. Only new hashes use it.
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:16384:8:1')
+
 class UserRole(enum.Enum):
     CITIZEN = "citizen"
     ADMIN = "admin"
@@ -26,6 +36,40 @@ class ComplaintPriority(enum.Enum):
     HIGH = "high"
     CRITICAL = "critical"
 
+class EnumNameComparator(Comparator):
+    """SQL comparisons against enum members use the member name stored in the column
+
+    Plain strings are read as enum values, exactly like the attribute setter.
+    """
+    def __init__(self, expression, enum_cls):
+        super().__init__(expression)
+        self.enum_cls = enum_cls
+    
+    def _name(self, value):
+        if isinstance(value, (list, tuple)):
+            return [self._name(v) for v in value]
+        if isinstance(value, (enum.Enum, str)):
+            return self.enum_cls(value).name
+        return value
+    
+    def operate(self, op, *other, **kwargs):
+        return op(self.expression, *[self._name(o) for o in other], **kwargs)
+
+def enum_property(column_attr, enum_cls):
+    """Expose a plain string column holding enum names as enum members in Python
+
+    Rows load as bare strings; the member lookup happens only when the attribute is read.
+    """
+    def fget(self):
+        name = getattr(self, column_attr)
+        return enum_cls[name] if name is not None else None
+    
+    def fset(self, value):
+        setattr(self, column_attr, enum_cls(value).name)
+    
+    prop = hybrid_property(fget, fset)
+    return prop.comparator(lambda cls: EnumNameComparator(getattr(cls, column_attr), enum_cls))
+
 class User(Base):
     __tablename__ = 'users'
     
@@ -36,7 +80,8 @@ class User(Base):
     full_name = Column(String(120), nullable=False)
     phone = Column(String(20))
     address = Column(Text)
-    role = Column(Enum(UserRole), default=UserRole.CITIZEN)
+    _role = Column('role', String(20), default=UserRole.CITIZEN.name)
+    role = enum_property('_role', UserRole)
     created_at = Column(DateTime, default=datetime.utcnow)
     is_active = Column(Integer, default=1)
     
@@ -45,7 +90,7 @@ class User(Base):
     responses = relationship('Response', back_populates='responder')
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generate_password_hash(password, method=PASSWORD_HASH_METHOD)
     
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
@@ -60,10 +105,12 @@ class Complaint(Base):
     description = Column(Text, nullable=False)
     category = Column(String(100), nullable=False)
     location = Column(String(200))
-    status = Column(Enum(ComplaintStatus), default=ComplaintStatus.PENDING)
-    priority = Column(Enum(ComplaintPriority), default=ComplaintPriority.MEDIUM)
-    assigned_to = Column(Integer, ForeignKey('users.id'), nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    _status = Column('status', String(20), default=ComplaintStatus.PENDING.name)
+    status = enum_property('_status', ComplaintStatus)
+    _priority = Column('priority', String(20), default=ComplaintPriority.MEDIUM.name)
+    priority = enum_property('_priority', ComplaintPriority)
+    assigned_to = Column(Integer, ForeignKey('users.id'), nullable=True, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     resolved_at = Column(DateTime, nullable=True)
     escalation_count = Column(Integer, default=0)
@@ -71,6 +118,12 @@ class Complaint(Base):
     user = relationship('User', back_populates='complaints', foreign_keys=[user_id])
     assigned_to_user = relationship('User', back_populates='assigned_complaints', foreign_keys=[assigned_to])
     responses = relationship('Response', back_populates='complaint', cascade='all, delete-orphan')
+    
+    # Serve the per-user and per-status listings/counts from the index
+    __table_args__ = (
+        Index('ix_complaints_user_created', 'user_id', 'created_at'),
+        Index('ix_complaints_status_created', 'status', 'created_at'),
+    )
 
 class Response(Base):
     __tablename__ = 'responses'
@@ -84,17 +137,63 @@ class Response(Base):
     
     complaint = relationship('Complaint', back_populates='responses')
     responder = relationship('User', back_populates='responses')
+    
+    __table_args__ = (
+        Index('ix_responses_complaint_created', 'complaint_id', 'created_at'),
+    )
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets dashboard reads run while a complaint is being written
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA cache_size=-65536')
+    cursor.execute('PRAGMA mmap_size=268435456')
+    cursor.close()
 
 # Database initialization
-def init_db(database_url='sqlite:///complaints.db'):
-    engine = create_engine(database_url)
+def init_db(database_url=None):
+    url = make_url(database_url or os.environ.get('DATABASE_URL', 'sqlite:///complaints.db'))
+    sqlite_file = url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+    if url.get_backend_name() == 'sqlite' and not sqlite_file:
+        # In-memory database (tests): every thread must share the one connection
+        engine_options = {'poolclass': StaticPool,
+                          'connect_args': {'check_same_thread': False}}
+    else:
+        engine_options = {'pool_size': 10, 'max_overflow': 20, 'pool_timeout': 30,
+                          'pool_recycle': 1800, 'pool_pre_ping': True}
+    if sqlite_file:
+        # Wait up to 30s for the write lock instead of failing with 'database is locked'
+        engine_options['connect_args'] = {'check_same_thread': False, 'timeout': 30}
+    if url.get_driver_name() == 'psycopg2':
+        # Send executemany() batches as multi-row INSERT ... VALUES statements
+        engine_options['executemany_mode'] = 'values_plus_batch'
+    engine = create_engine(url, query_cache_size=1200, future=True, **engine_options)
+    if sqlite_file:
+        event.listen(engine, 'connect', _set_sqlite_pragmas)
+    # One session per greenlet (so per gevent request, or per thread otherwise);
+    # callers must call Session.remove() when done
+    Session = scoped_session(sessionmaker(bind=engine, autoflush=False,
+                                          expire_on_commit=False),
+                             scopefunc=getcurrent)
+    return Session, engine
+
+def create_schema(engine):
+    """Create missing tables and indexes; run once per deploy, not in every worker"""
     Base.metadata.create_all(engine)
-    Session = sessionmaker(bind=engine)
-    return Session(), engine
+    # create_all skips existing tables, so add any indexes they are missing
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+def bulk_add_responses(session, rows):
+    """Insert many responses (dicts of Response column values) in one executemany"""
+    session.bulk_insert_mappings(Response, rows)
+    session.commit()
 
 def create_admin_user(session):
     """Create default admin user if not exists"""
-    admin = session.query(User).filter_by(username='admin').first()
+    admin = session.scalars(select(User).where(User.username == 'admin')).first()
     if not admin:
         admin = User(
             email='admin@localgov.com',
@@ -105,6 +204,11 @@ def create_admin_user(session):
         )
         admin.set_password('admin123')
         session.add(admin)
-        session.commit()
+        try:
+            session.commit()
+        except IntegrityError:
+            # Another worker process created it first
+            session.rollback()
+            return session.scalars(select(User).where(User.username == 'admin')).one()
         print("Admin user created: username='admin', password='admin123'")
     return admin
\ No newline at end of file
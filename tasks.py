@@ -0,0 +1,24 @@
+import os
+from celery import Celery
+from celery.utils.log import get_task_logger
+
+# Broker shares the Redis used for sessions; without REDIS_URL tasks run inline
+redis_url = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+if redis_url.startswith('unix://'):
+    # kombu names the redis unix socket transport redis+socket://
+    redis_url = 'redis+socket://' + redis_url[len('unix://'):]
+celery = Celery('lgr', broker=redis_url)
+celery.conf.task_always_eager = not os.environ.get('REDIS_URL')
+celery.conf.task_ignore_result = True
+# Publishing happens inside request handlers: bound every socket operation so an
+# unreachable or hung broker fails fast instead of blocking the request
+celery.conf.broker_transport_options = {'socket_connect_timeout': 1, 'socket_timeout': 1}
+celery.conf.task_publish_retry_policy = {'max_retries': 1, 'interval_start': 0,
+                                         'interval_step': 0.2, 'interval_max': 0.2}
+
+logger = get_task_logger(__name__)
+
+@celery.task
+def send_complaint_notification(email, ticket_number, message):
+    """Notify a complainant about their complaint (hook for email/SMS delivery)"""
+    logger.info('Notify %s about %s: %s', email, ticket_number, message)
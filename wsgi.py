@@ -0,0 +1,8 @@
+import os
+
+# Run `flask --app app init-db` once (the Procfile release step) before starting
+# workers; they do not create the schema themselves
+if not os.environ.get('SECRET_KEY'):
+    raise RuntimeError('SECRET_KEY must be set so all workers sign sessions with the same key')
+
+from app import app